@@ -1,37 +1,117 @@
+import functools
 import subprocess
 import logging
 import os
-from typing import List, Dict
+import re
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import List, Dict, Optional
 
 logger = logging.getLogger(__name__)
 
-def build_robocopy_command(task: Dict, robocopy_options: Dict) -> List[str]:
+# How much of a robocopy log to report when a task fails
+_LOG_TAIL_BYTES = 64 * 1024
+
+# Characters not safe in a file name on Windows; replaced when naming robocopy logs
+_UNSAFE_FILENAME_CHARS = re.compile(r'[<>:"/\\|?*\x00-\x1f]')
+
+# Seconds to wait for source paths to respond before treating them as unreachable
+_SOURCE_PROBE_TIMEOUT = 3.0
+
+# One lock per destination volume so parallel tasks writing to the same disk
+# take turns instead of thrashing it.
+_volume_locks: Dict[str, threading.Lock] = {}
+_volume_locks_guard = threading.Lock()
+
+def _get_volume_lock(destination: str) -> threading.Lock:
     """
-    Constructs the robocopy command list for subprocess.run.
+    Returns the lock shared by all tasks whose destination is on the same volume.
+    """
+    volume = os.path.splitdrive(destination)[0].upper()
+    with _volume_locks_guard:
+        lock = _volume_locks.get(volume)
+        if lock is None:
+            lock = threading.Lock()
+            _volume_locks[volume] = lock
+        return lock
+
+# Environment variables robocopy actually needs; the rest of ours isn't passed on
+_CHILD_ENV_VARS = ("SYSTEMROOT", "SYSTEMDRIVE", "WINDIR", "PATH", "PATHEXT", "TEMP", "TMP",
+                   "USERPROFILE", "USERNAME", "USERDOMAIN", "COMPUTERNAME")
+
+def _build_subprocess_kwargs() -> Dict:
+    """
+    Returns the keyword arguments used to launch robocopy.
+    """
+    kwargs = {
+        "shell": False,
+        "close_fds": True,
+        "env": {key: os.environ[key] for key in _CHILD_ENV_VARS if key in os.environ},
+    }
+    if sys.platform == "win32":
+        # Don't allocate a console window per child. Without a console the children never see
+        # our Ctrl+C, so run_all_backups terminates them itself when a run is interrupted.
+        kwargs["creationflags"] = subprocess.CREATE_NO_WINDOW | subprocess.CREATE_NEW_PROCESS_GROUP
+    return kwargs
+
+_SUBPROCESS_KWARGS = _build_subprocess_kwargs()
+
+# robocopy processes currently running, so an interrupted run can terminate them.
+# _run_cancelled is set under the same lock so no new process starts after that.
+_running_processes = set()
+_running_processes_lock = threading.Lock()
+_run_cancelled = threading.Event()
+
+def _terminate_running_processes() -> None:
+    """
+    Stops any robocopy processes still running and prevents new ones from starting.
+    """
+    with _running_processes_lock:
+        _run_cancelled.set()
+        for process in _running_processes:
+            try:
+                process.terminate()
+            except OSError:
+                pass
+
+# Flags selected by a task's backup_type; unknown types add neither
+_BACKUP_TYPE_FLAGS = {"full": ("/MIR",), "incremental": ("/E",)}
+
+# /Z: restartable, /TS: timestamp, /NP: no progress, /NDL: no dir list, /NFL: no file list
+_COMMON_FLAGS = ("/Z", "/TS", "/NP", "/NDL", "/NFL")
+
+@functools.cache
+def _is_file_pattern(item: str) -> bool:
+    """
+    Heuristic for exclude entries: a leading '*' or a dot anywhere marks a file pattern (/XF),
+    anything else is a directory name or glob (/XD). Cached since tasks tend to share patterns.
+    """
+    return item.startswith("*") or "." in item
+
+def _build_command_tail(task: Dict, robocopy_options: Dict) -> tuple:
+    """
+    Builds the robocopy options for a task: everything after source and destination
+    except the per-run /LOG+ switch.
     """
-    source = task.get("source")
-    destination = task.get("destination")
     backup_type = task.get("backup_type", "full")
     exclude = task.get("exclude", [])
     
-    retry_count = robocopy_options.get("retry_count", 3)
-    wait_time = robocopy_options.get("wait_time", 5)
+    # Defaults are filled in by utils.load_config
+    retry_count = robocopy_options["retry_count"]
+    wait_time = robocopy_options["wait_time"]
+    mt_threads = robocopy_options["mt_threads"]
 
-    cmd = ["robocopy", source, destination]
-
-    # Backup Type
-    if backup_type == "full":
-        cmd.append("/MIR")
-    elif backup_type == "incremental":
-        cmd.append("/E")
-    
-    # Common Flags
-    # /Z: restartable, /TS: timestamp, /NP: no progress, /NDL: no dir list, /NFL: no file list
-    cmd.extend(["/Z", "/TS", "/NP", "/NDL", "/NFL"])
+    if isinstance(mt_threads, bool) or not isinstance(mt_threads, int) or not 1 <= mt_threads <= 128:
+        raise ValueError(f"mt_threads must be an integer between 1 and 128, got: {mt_threads}")
 
-    # Retry Options
-    cmd.append(f"/R:{retry_count}")
-    cmd.append(f"/W:{wait_time}")
+    # /MT is multithreaded copy. Note it cannot be combined with /IPG or /EFSRAW.
+    tail = [
+        *_BACKUP_TYPE_FLAGS.get(backup_type, ()),
+        *_COMMON_FLAGS,
+        f"/R:{retry_count}", f"/W:{wait_time}", f"/MT:{mt_threads}",
+    ]
 
     # Exclusions
     # Separating directories and files for exclusion is tricky without knowing if the pattern is a file or dir.
@@ -44,100 +124,279 @@ def build_robocopy_command(task: Dict, robocopy_options: Dict) -> List[str]:
     # Let's assume 'exclude' contains directory names for /XD as that's the most common use case for folder sync.
     # If the user provides file extensions (e.g. *.tmp), we should probably use /XF.
     
-    excluded_dirs = []
-    excluded_files = []
-    
+    # Classify in a single pass straight into the argv tails, each seeded with its switch
+    dirs_tail = ["/XD"]
+    files_tail = ["/XF"]
     for item in exclude:
-        # Simple heuristic: if it looks like a file extension or has a dot, treat as file pattern?
-        # Or just put everything in /XD if no clear distinction? 
-        # The spec says "For directories: mapped to /XD... For files: mapped to /XF".
-        # Let's support both if we can distinguish. 
-        # For now, let's assume if it starts with * it's a file pattern.
-        if item.startswith("*") or "." in item:
-             excluded_files.append(item)
-        else:
-             excluded_dirs.append(item)
+        (files_tail if _is_file_pattern(item) else dirs_tail).append(item)
 
-    if excluded_dirs:
-        cmd.append("/XD")
-        cmd.extend(excluded_dirs)
+    if len(dirs_tail) > 1:
+        tail += dirs_tail
     
-    if excluded_files:
-        cmd.append("/XF")
-        cmd.extend(excluded_files)
+    if len(files_tail) > 1:
+        tail += files_tail
+
+    return tuple(tail)
+
+# Tails built by precompile_tasks: (config, its robocopy_options, {id(task): tail}).
+# Holding the config keeps its task dicts alive, so their ids stay valid.
+_precompiled: tuple = (None, None, {})
+
+def precompile_tasks(config: Dict) -> None:
+    """
+    Builds each task's robocopy options once for this config object; build_robocopy_command
+    then looks them up instead of rebuilding them. Does nothing if the config was already
+    precompiled, and doesn't modify the config (load_config shares it between callers).
+    Raises ValueError for invalid robocopy options.
+    """
+    global _precompiled
+    if _precompiled[0] is config:
+        return
+    robocopy_options = config.get("robocopy_options", {})
+    tails = {
+        id(task): _build_command_tail(task, robocopy_options)
+        for task in config.get("backup_tasks", [])
+    }
+    _precompiled = (config, robocopy_options, tails)
+
+def build_robocopy_command(task: Dict, robocopy_options: Dict, log_path: Optional[str] = None) -> List[str]:
+    """
+    Constructs the robocopy command list for subprocess.run.
+    Uses the precompiled options when task and robocopy_options come from the config
+    last passed to precompile_tasks, and builds them otherwise.
+    If log_path is given, robocopy appends its own output to that file.
+    """
+    _, precompiled_options, tails = _precompiled
+    tail = tails.get(id(task)) if robocopy_options is precompiled_options else None
+    if tail is None:
+        tail = _build_command_tail(task, robocopy_options)
+
+    cmd = ["robocopy", task.get("source"), task.get("destination"), *tail]
+
+    # Let robocopy write its own log; recommended with /MT and avoids piping output through Python
+    if log_path:
+        cmd.append(f"/LOG+:{log_path}")
 
     return cmd
 
-def run_backup_task(task: Dict, robocopy_options: Dict) -> bool:
+def _read_robocopy_log(log_path: Optional[str]) -> str:
+    """
+    Returns the last _LOG_TAIL_BYTES of a robocopy log file for error reporting.
+    """
+    if not log_path:
+        return ""
+    try:
+        with open(log_path, 'rb') as f:
+            f.seek(0, os.SEEK_END)
+            f.seek(max(0, f.tell() - _LOG_TAIL_BYTES))
+            return f.read().decode(errors='replace')
+    except OSError as e:
+        return f"<unable to read robocopy log {log_path}: {e}>"
+
+def _discard_robocopy_log(log_path: Optional[str]) -> None:
+    """
+    Removes a robocopy log that is no longer needed. Logs are only kept for failed tasks.
+    """
+    if not log_path:
+        return
+    try:
+        os.remove(log_path)
+    except OSError:
+        pass
+
+def _probe_path(path: str) -> bool:
+    """
+    Returns True if path can be stat'ed.
+    """
+    try:
+        os.stat(path)
+        return True
+    except OSError:
+        return False
+
+def _prevalidate_tasks(tasks: List[Dict]) -> Dict[str, Optional[bool]]:
+    """
+    Stats every distinct source path once and returns path -> exists.
+    Destinations aren't checked; run_backup_task creates them as needed.
+    The stats run concurrently and any still pending after _SOURCE_PROBE_TIMEOUT
+    (e.g. an offline network share) map to None (unreachable). They run on daemon threads,
+    so a stat that stays blocked doesn't hold up process exit either.
+    """
+    sources = list(dict.fromkeys(task.get("source") for task in tasks if task.get("source")))
+    results: Dict[str, bool] = {}
+    results_lock = threading.Lock()
+
+    def probe(source):
+        exists = _probe_path(source)
+        with results_lock:
+            results[source] = exists
+
+    threads = [threading.Thread(target=probe, args=(source,), daemon=True) for source in sources]
+    for thread in threads:
+        thread.start()
+
+    deadline = time.monotonic() + _SOURCE_PROBE_TIMEOUT
+    for thread in threads:
+        thread.join(max(0.0, deadline - time.monotonic()))
+
+    with results_lock:
+        return {source: results.get(source) for source in sources}
+
+def run_backup_task(task: Dict, robocopy_options: Dict, log_dir: Optional[str] = None,
+                    path_exists: Optional[Dict[str, Optional[bool]]] = None) -> bool:
     """
     Runs a single backup task. Returns True if successful (exit code < 8), False otherwise.
+    If log_dir is given, robocopy's output is written to a per-task log file there,
+    which is deleted again unless the task fails (exit code >= 8).
+    path_exists is the result of _prevalidate_tasks (None marks a source that timed out);
+    paths missing from it are checked directly.
     """
+    def exists(path):
+        if path_exists is not None and path in path_exists:
+            return path_exists[path]
+        return os.path.exists(path)
+
     name = task.get("name", "Unnamed Task")
     source = task.get("source")
     destination = task.get("destination")
 
-    logger.info(f"Starting task: {name}")
-    logger.info(f"Source: {source}")
-    logger.info(f"Destination: {destination}")
+    # One record per phase, with lazy %-formatting
+    logger.info("Starting task: %s | src=%s dst=%s", name, source, destination)
 
-    if not os.path.exists(source):
-        logger.error(f"Source directory does not exist: {source}")
+    source_exists = exists(source)
+    if source_exists is None:
+        logger.error("Source not reachable within %ss: %s", _SOURCE_PROBE_TIMEOUT, source)
+        return False
+    if not source_exists:
+        logger.error("Source directory does not exist: %s", source)
         return False
 
-    # Create destination if it doesn't exist (Robocopy usually does this, but good to be safe/explicit)
-    if not os.path.exists(destination):
-        try:
-            os.makedirs(destination)
-        except OSError as e:
-            logger.error(f"Failed to create destination directory: {e}")
-            return False
+    # Create destination if it doesn't exist (Robocopy usually does this, but good to be safe/explicit).
+    # exist_ok avoids a separate existence check and the race between check and create.
+    try:
+        os.makedirs(destination, exist_ok=True)
+    except OSError as e:
+        logger.error("Failed to create destination directory: %s", e)
+        return False
 
-    cmd = build_robocopy_command(task, robocopy_options)
-    logger.info(f"Command: {' '.join(cmd)}")
+    log_path = None
+    if log_dir:
+        timestamp = time.strftime("%Y%m%d_%H%M%S")
+        safe_name = _UNSAFE_FILENAME_CHARS.sub("_", name)
+        log_path = os.path.join(log_dir, f"robocopy_{safe_name}_{timestamp}.log")
 
     try:
-        # check=False because robocopy returns non-zero for success (1-7)
-        result = subprocess.run(cmd, check=False, capture_output=True, text=True)
-        
-        return_code = result.returncode
-        logger.info(f"Robocopy return code: {return_code}")
+        cmd = build_robocopy_command(task, robocopy_options, log_path)
+    except ValueError as e:
+        logger.error("Invalid robocopy options: %s", e)
+        return False
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Command: %s", " ".join(cmd))
+
+    try:
+        with _get_volume_lock(destination):
+            with _running_processes_lock:
+                if _run_cancelled.is_set():
+                    logger.warning("Task not started, run was interrupted: %s", name)
+                    return False
+                # Output goes to the robocopy log; nothing is piped back to us
+                process = subprocess.Popen(
+                    cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, **_SUBPROCESS_KWARGS
+                )
+                _running_processes.add(process)
+            try:
+                # robocopy returns non-zero for success (1-7)
+                return_code = process.wait()
+            finally:
+                with _running_processes_lock:
+                    _running_processes.discard(process)
+
+        if _run_cancelled.is_set():
+            logger.warning("Task interrupted: %s (Code %s)", name, return_code)
+            return False
         
         if return_code >= 16:
             # Serious error - complete failure
-            logger.error(f"Task failed with return code {return_code}")
-            logger.error(f"Stdout: {result.stdout}")
-            logger.error(f"Stderr: {result.stderr}")
+            logger.error("Task failed: %s (Code %s)\nRobocopy log: %s",
+                         name, return_code, _read_robocopy_log(log_path))
             return False
         elif return_code >= 8:
             # Partial failure - some files/dirs failed but others succeeded
-            logger.warning(f"Task completed with warnings/partial failures (Code {return_code})")
-            logger.warning(f"Stdout: {result.stdout}")
+            logger.warning("Task completed with warnings/partial failures: %s (Code %s)\nRobocopy log: %s",
+                           name, return_code, _read_robocopy_log(log_path))
             return True  # or False, depending on your requirements
         else:
-            logger.info(f"Task completed successfully (Code {return_code})")
+            logger.info("Task completed successfully: %s (Code %s)", name, return_code)
+            _discard_robocopy_log(log_path)
             return True
 
     except Exception as e:
-        logger.error(f"An error occurred while executing robocopy: {e}")
+        logger.error("An error occurred while executing robocopy: %s", e)
+        _discard_robocopy_log(log_path)
         return False
 
+def _parallel_tasks(robocopy_options: Dict, task_count: int) -> int:
+    """
+    Returns how many tasks to run at once: robocopy_options["parallel_tasks"] if set,
+    otherwise up to 4. Tasks target independent source/destination pairs, so they can
+    run concurrently. Raises ValueError for an invalid setting.
+    """
+    if "parallel_tasks" not in robocopy_options:
+        return max(1, min(4, task_count))
+    parallel_tasks = robocopy_options["parallel_tasks"]
+    if isinstance(parallel_tasks, bool) or not isinstance(parallel_tasks, int) or parallel_tasks < 1:
+        raise ValueError(f"parallel_tasks must be a positive integer, got: {parallel_tasks}")
+    return parallel_tasks
+
 def run_all_backups(config: Dict) -> int:
     """
     Runs all configured backup tasks. Returns 0 if all success, 1 if any failure.
     """
     tasks = config.get("backup_tasks", [])
     robocopy_options = config.get("robocopy_options", {})
+    log_file = config.get("logging", {}).get("file")
+    log_dir = os.path.dirname(os.path.abspath(log_file)) if log_file else None
     
     failed_tasks = 0
-    
-    for task in tasks:
-        success = run_backup_task(task, robocopy_options)
-        if not success:
-            failed_tasks += 1
+
+    # Build every task's robocopy options up front; invalid options fail the run here,
+    # after logging is set up, rather than once per task
+    try:
+        precompile_tasks(config)
+        max_workers = _parallel_tasks(robocopy_options, len(tasks))
+    except ValueError as e:
+        logger.error("Invalid robocopy options: %s", e)
+        return 1
+
+    # Stat each distinct source once up front rather than once per task
+    path_exists = _prevalidate_tasks(tasks)
+
+    _run_cancelled.clear()
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    try:
+        futures = {
+            executor.submit(run_backup_task, task, robocopy_options, log_dir, path_exists): task
+            for task in tasks
+        }
+        for future in as_completed(futures):
+            try:
+                success = future.result()
+            except Exception as e:
+                name = futures[future].get("name", "Unnamed Task")
+                logger.error("Task %s raised an unexpected error: %s", name, e)
+                success = False
+            if not success:
+                failed_tasks += 1
+    except BaseException:
+        # e.g. Ctrl+C: stop the running robocopy processes and don't start the queued tasks
+        _terminate_running_processes()
+        executor.shutdown(wait=False, cancel_futures=True)
+        raise
+    executor.shutdown()
             
     if failed_tasks == 0:
         logger.info("All backup tasks completed successfully.")
         return 0
     else:
-        logger.error(f"{failed_tasks} task(s) failed.")
+        logger.error("%s task(s) failed.", failed_tasks)
         return 1
@@ -1,18 +1,10 @@
 import argparse
 import sys
-import logging
 import os
 
 # Add project root to sys.path to allow imports from src
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-try:
-    from src import utils, backup
-except ImportError:
-    # Fallback for when running directly from src folder
-    import utils
-    import backup
-
 def main():
     parser = argparse.ArgumentParser(description="Windows Folder Backup System")
     parser.add_argument("--run-backup", action="store_true", help="Run in CLI backup mode")
@@ -21,6 +13,15 @@ def main():
     args = parser.parse_args()
 
     if args.run_backup:
+        # Imported here so that non-backup invocations don't pay for the backup/logging import tree
+        import logging
+        try:
+            from src import utils, backup
+        except ImportError:
+            # Fallback for when running directly from src folder
+            import utils
+            import backup
+
         try:
             # Load Config
             # Assuming config.json is in the project root, relative to where script is run